@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fake ZAP - a local stand-in of the OWASP ZAP JSON API, to benchmark ZAP Library without ZAP.
+
+The server answers the ZAP API requests the library sends through its proxy: active scans and
+spiders whose progress grows with time, a passive scan backlog that drains with time, a
+configurable volume of alerts served in pages, and reports of a configurable size.
+Every API call is counted in ``calls``.
+"""
+
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+RISKS = ('Informational', 'Low', 'Medium', 'High')
+CONFIDENCES = ('Low', 'Medium', 'High', 'Confirmed')
+ACTIVE_SCANNERS = ('40012', '40014', '40018', '40019')
+PASSIVE_SCANNERS = ('10020', '10021', '10038', '10202')
+PLUGINS = (('40012', 'Cross Site Scripting (Reflected)'), ('40018', 'SQL Injection'),
+           ('10020', 'Missing Anti-clickjacking Header'), ('10021', 'X-Content-Type-Options Header Missing'),
+           ('10038', 'Content Security Policy (CSP) Header Not Set'))
+
+
+class FakeZap(ThreadingMixIn, HTTPServer):
+    """Fake ZAP API listening on ``host``:``port``, 0 picks a free port.
+
+    Arguments:
+
+    - ``scan_seconds``: duration of each active scan and spider
+    - ``alerts``: number of alerts raised
+    - ``evidence_bytes``: size of the evidence of each alert, to mimic big alerts
+    - ``report_bytes``: size of the reports
+    - ``passive_records``: passive scan backlog when the server starts
+    - ``passive_rate``: passive scan records drained per second
+
+    Set ``alerts_by_risk`` to False to mimic a ZAP without the ``alert.alertsByRisk`` view, and
+    ``truncate_reports`` to True to drop the connection halfway through the reports.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, scan_seconds=1.0, alerts=1000, evidence_bytes=512,
+                 report_bytes=1024 * 1024, passive_records=0, passive_rate=1000):
+        HTTPServer.__init__(self, (host, port), _Handler)
+        self.scan_seconds = scan_seconds
+        self.alerts = alerts
+        self.evidence_bytes = evidence_bytes
+        self.report_bytes = report_bytes
+        self.passive_records = passive_records
+        self.passive_rate = passive_rate
+        self.alerts_by_risk = True
+        self.truncate_reports = False
+        self.started = time.time()
+        self.scans = {}
+        self.policies = {'Default Policy': self.new_policy()}
+        self.passive_scanners = dict((scanner, True) for scanner in PASSIVE_SCANNERS)
+        self.spiders = {}
+        self.stopped = {}
+        self._ids = itertools.count()
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def proxy(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def count(self, path):
+        with self._lock:
+            self.calls[path] += 1
+
+    def new_scan(self, scans):
+        with self._lock:
+            scanid = str(next(self._ids))
+            scans[scanid] = time.time()
+        return scanid
+
+    def stop_scan(self, scans, scanid):
+        if scanid in scans:
+            self.stopped[scanid] = self.progress(scans, scanid)
+        return {'Result': 'OK'}
+
+    @staticmethod
+    def new_policy():
+        return {'attackStrength': 'MEDIUM', 'alertThreshold': 'MEDIUM',
+                'scanners': dict((scanner, {'enabled': True}) for scanner in ACTIVE_SCANNERS)}
+
+    def progress(self, scans, scanid):
+        started = scans.get(scanid)
+        if started is None:
+            return None
+        if scanid in self.stopped:
+            return self.stopped[scanid]
+        if not self.scan_seconds:
+            return 100
+        return min(100, int(100 * (time.time() - started) / self.scan_seconds))
+
+    def records_to_scan(self):
+        return max(0, int(self.passive_records - (time.time() - self.started) * self.passive_rate))
+
+    def alert(self, index):
+        """Returns the alert at ``index``, alerts are generated on demand and never stored."""
+        pluginid, name = PLUGINS[index % len(PLUGINS)]
+        return {'id': str(index), 'pluginId': pluginid, 'alert': name, 'name': name,
+                'risk': RISKS[index % len(RISKS)], 'confidence': CONFIDENCES[index % len(CONFIDENCES)],
+                'url': 'http://target/page/{}'.format(index // 10), 'param': 'param{}'.format(index % 10),
+                'method': 'GET', 'attack': '', 'evidence': 'x' * self.evidence_bytes,
+                'description': 'Fake alert {}'.format(index), 'solution': '', 'reference': ''}
+
+    def alert_indexes(self, riskid=None):
+        if riskid is None:
+            return range(self.alerts)
+        return range(int(riskid), self.alerts, len(RISKS))
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        path = url.path.strip('/')
+        self.server.count(path)
+        if path.startswith('OTHER/core/other/') and path.endswith('report'):
+            return self._send_report()
+        try:
+            body = self._view(path.split('/', 1)[-1], params)
+        except KeyError:
+            return self._send(400, {'code': 'bad_view', 'message': path})
+        return self._send(200, body)
+
+    do_POST = do_GET
+
+    def _view(self, path, params):
+        server = self.server
+        if path == 'core/view/version':
+            return {'version': 'fake'}
+        if path == 'core/action/shutdown':
+            return {'Result': 'OK'}
+        if path == 'ascan/action/scan' or path == 'ascan/action/scanAsUser':
+            return {'scan': server.new_scan(server.scans)}
+        if path == 'ascan/view/status':
+            progress = server.progress(server.scans, params.get('scanId'))
+            return {'status': 'does_not_exist' if progress is None else str(progress)}
+        if path == 'ascan/action/stop':
+            return server.stop_scan(server.scans, params.get('scanId'))
+        if path == 'ascan/action/removeAllScans':
+            server.scans.clear()
+            return {'Result': 'OK'}
+        if path == 'ascan/view/scans':
+            return {'scans': [{'id': scanid, 'progress': str(server.progress(server.scans, scanid)),
+                               'state': 'FINISHED' if scanid in server.stopped
+                               or server.progress(server.scans, scanid) >= 100 else 'RUNNING'}
+                              for scanid in list(server.scans)]}
+        if path == 'ascan/view/scanProgress':
+            seconds = int(server.scan_seconds * 1000 / len(PLUGINS))
+            return {'scanProgress': ['http://target', {'HostProcess': [
+                {'Plugin': [name, pluginid, 'release', 'Complete', str(seconds), '100', '1']}
+                for pluginid, name in PLUGINS]}]}
+        if path == 'ascan/view/optionHostPerScan':
+            return {'HostPerScan': '2'}
+        if path == 'ascan/view/scanPolicyNames':
+            return {'scanPolicyNames': sorted(server.policies)}
+        if path in ('ascan/action/addScanPolicy', 'ascan/action/updateScanPolicy'):
+            policy = server.policies.setdefault(params['scanPolicyName'], server.new_policy())
+            policy.update((key, params[key]) for key in ('attackStrength', 'alertThreshold') if key in params)
+            return {'Result': 'OK'}
+        if path == 'ascan/action/disableAllScanners':
+            for scanner in server.policies[params.get('scanPolicyName', 'Default Policy')]['scanners'].values():
+                scanner['enabled'] = False
+            return {'Result': 'OK'}
+        if path == 'ascan/action/enableScanners':
+            scanners = server.policies[params.get('scanPolicyName', 'Default Policy')]['scanners']
+            for scanner in params['ids'].split(','):
+                scanners[scanner]['enabled'] = True
+            return {'Result': 'OK'}
+        if path in ('ascan/action/setScannerAttackStrength', 'ascan/action/setScannerAlertThreshold'):
+            key = 'attackStrength' if path.endswith('AttackStrength') else 'alertThreshold'
+            scanners = server.policies[params.get('scanPolicyName', 'Default Policy')]['scanners']
+            scanners[params['id']][key] = params[key]
+            return {'Result': 'OK'}
+        if path == 'spider/action/scan':
+            return {'scan': server.new_scan(server.spiders)}
+        if path == 'spider/action/stop':
+            return server.stop_scan(server.spiders, params.get('scanId'))
+        if path == 'spider/view/status':
+            progress = server.progress(server.spiders, params.get('scanId'))
+            return {'status': 'does_not_exist' if progress is None else str(progress)}
+        if path == 'pscan/view/recordsToScan':
+            return {'recordsToScan': str(server.records_to_scan())}
+        if path == 'pscan/view/scanners':
+            return {'scanners': [{'id': scanner, 'name': 'Scanner {}'.format(scanner),
+                                  'enabled': str(enabled).lower(), 'alertThreshold': 'MEDIUM'}
+                                 for scanner, enabled in sorted(server.passive_scanners.items())]}
+        if path in ('pscan/action/enableAllScanners', 'pscan/action/disableAllScanners'):
+            for scanner in server.passive_scanners:
+                server.passive_scanners[scanner] = path.endswith('enableAllScanners')
+            return {'Result': 'OK'}
+        if path in ('pscan/action/enableScanners', 'pscan/action/disableScanners'):
+            for scanner in params['ids'].split(','):
+                server.passive_scanners[scanner] = path.endswith('enableScanners')
+            return {'Result': 'OK'}
+        if path == 'core/view/alerts':
+            indexes = server.alert_indexes(params.get('riskId'))
+            start = int(params.get('start', 0))
+            count = int(params.get('count', 0)) or len(indexes)
+            return {'alerts': [server.alert(index) for index in indexes[start:start + count]]}
+        if path == 'core/view/numberOfAlerts':
+            return {'numberOfAlerts': str(len(server.alert_indexes(params.get('riskId'))))}
+        if path == 'core/view/alertsSummary':
+            return {'alertsSummary': dict((risk, len(server.alert_indexes(riskid)))
+                                          for riskid, risk in enumerate(RISKS))}
+        if path == 'alert/view/alertsByRisk' and server.alerts_by_risk:
+            by_risk = dict((risk, {}) for risk in RISKS)
+            for index in range(server.alerts):
+                pluginid, name = PLUGINS[index % len(PLUGINS)]
+                by_risk[RISKS[index % len(RISKS)]].setdefault(name, []).append(
+                    {'pluginId': pluginid, 'confidence': CONFIDENCES[index % len(CONFIDENCES)]})
+            return {'alertsByRisk': [{risk: [{name: instances} for name, instances in alerts.items()]}
+                                     for risk, alerts in by_risk.items()]}
+        raise KeyError(path)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_report(self):
+        size = self.server.report_bytes
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = b'x' * 65536
+        if self.server.truncate_reports:
+            self.close_connection = True
+            size //= 2
+        while size > 0:
+            self.wfile.write(chunk[:size])
+            size -= len(chunk)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Runs a fake ZAP API until interrupted.')
+    parser.add_argument('--port', type=int, default=8090, help='0 picks a free port')
+    parser.add_argument('--scan-seconds', type=float, default=10)
+    parser.add_argument('--alerts', type=int, default=1000)
+    parser.add_argument('--evidence-bytes', type=int, default=512)
+    parser.add_argument('--report-bytes', type=int, default=1024 * 1024)
+    options = parser.parse_args()
+    zap = FakeZap(port=options.port, scan_seconds=options.scan_seconds, alerts=options.alerts,
+                  evidence_bytes=options.evidence_bytes, report_bytes=options.report_bytes)
+    print('Fake ZAP listening on {}'.format(zap.proxy))
+    sys.stdout.flush()
+    zap.serve_forever()
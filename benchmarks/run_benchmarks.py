@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+ZAP Library benchmarks - compares the library keywords with the strategies they replaced, against
+the local fake ZAP API of ``fake_zap.py``, so no ZAP nor network is needed.
+
+Each benchmark reports its wall time, the peak of Python memory allocated while it ran and the
+number of ZAP API calls it made. The fake ZAP runs in its own process, so the memory peak only
+counts the allocations of the library.
+
+    python benchmarks/run_benchmarks.py --alerts 20000 --report-mb 50 --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zapLibrary import zapLibrary  # noqa: E402
+
+FAKE_ZAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_zap.py')
+
+TARGET = 'http://target'
+
+
+def legacy_scan_wait(library, url, interval):
+    """Active scan wait of the library before the adaptive waiter: fixed sleeps, two status calls per loop."""
+    scanid = library.zap.ascan.scan(url)
+    library.zap.ascan.scan(url)
+    while int(library.zap.ascan.status(scanid)) < 100:
+        library.zap.ascan.status(scanid)
+        time.sleep(interval)
+
+
+def legacy_report(library, path):
+    """Report saving before Save Zap Report: the whole report as a string, then written."""
+    with open(path, 'w') as f:
+        f.write(library.zap.core.htmlreport())
+
+
+def count_batches(library, url):
+    return sum(len(batch) for batch in library.get_zap_alert_batches(url))
+
+
+def start_fake_zap(options):
+    """Starts fake_zap.py in its own process, returns the process and the URL it listens on."""
+    process = subprocess.Popen([sys.executable, FAKE_ZAP, '--port', '0', '--scan-seconds', str(options.scan_seconds),
+                                '--alerts', str(options.alerts), '--evidence-bytes', str(options.evidence_bytes),
+                                '--report-bytes', str(int(options.report_mb * 1048576))],
+                               stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('Fake ZAP listening on '):
+        process.kill()
+        raise RuntimeError('Fake ZAP did not start: {}'.format(line))
+    return process, line.split()[-1]
+
+
+def measure(name, library, function):
+    """Runs ``function``, the API calls are counted by the library timings."""
+    library.reset_zap_timings()
+    tracemalloc.start()
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'benchmark': name, 'seconds': round(seconds, 3), 'peak_mb': round(peak / 1048576.0, 2),
+            'api_calls': sum(entry['count'] for entry in library._timings.api_calls.values())}
+
+
+def run(options):
+    results = []
+    workdir = tempfile.mkdtemp(prefix='zaplibrary-bench-')
+    zap, proxy = start_fake_zap(options)
+    try:
+        library = zapLibrary('', proxy)
+        library.set_scan_wait_options(use_events=False)
+
+        results.append(measure('scan wait: fixed {}s polling'.format(options.legacy_interval), library,
+                               lambda: legacy_scan_wait(library, TARGET, options.legacy_interval)))
+        results.append(measure('scan wait: adaptive backoff', library,
+                               lambda: library.perform_url_active_scan(TARGET)))
+
+        results.append(measure('alerts: single core.alerts call', library, lambda: library.zap.core.alerts(TARGET)))
+        results.append(measure('alerts: Get Zap Alerts, paged', library, lambda: library.get_zap_alerts(TARGET)))
+        results.append(measure('alerts: Get Zap Alert Batches, streamed', library,
+                               lambda: count_batches(library, TARGET)))
+        results.append(measure('alerts: Get Zap Alert Summary', library,
+                               lambda: library.get_zap_alert_summary(TARGET)))
+
+        report = os.path.join(workdir, 'report.html')
+        results.append(measure('report: Get Zap Html Report + write', library, lambda: legacy_report(library, report)))
+        results.append(measure('report: Save Zap Report', library, lambda: library.save_zap_report(report)))
+        results.append(measure('report: Save Zap Report, gzip', library,
+                               lambda: library.save_zap_report(report + '.gz')))
+
+        targets = ['{}/{}'.format(TARGET, index) for index in range(options.targets)]
+        results.append(measure('{} targets: serial Perform URL Active Scan'.format(options.targets), library,
+                               lambda: [library.perform_url_active_scan(target) for target in targets]))
+        results.append(measure('{} targets: Perform Active Scans, {} at a time'.format(options.targets,
+                                                                                      options.concurrency), library,
+                               lambda: library.perform_active_scans(targets, options.concurrency)))
+    finally:
+        zap.kill()
+        zap.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks ZAP Library against a fake ZAP API.')
+    parser.add_argument('--scan-seconds', type=float, default=2, help='duration of each fake active scan')
+    parser.add_argument('--legacy-interval', type=float, default=5, help='sleep of the fixed polling strategy')
+    parser.add_argument('--alerts', type=int, default=20000, help='number of fake alerts')
+    parser.add_argument('--evidence-bytes', type=int, default=1024, help='evidence size of each fake alert')
+    parser.add_argument('--report-mb', type=float, default=50, help='size of the fake reports')
+    parser.add_argument('--targets', type=int, default=8, help='targets of the multi-target scan benchmarks')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent scans of Perform Active Scans')
+    parser.add_argument('--json', help='file where the results are saved as JSON')
+    options = parser.parse_args()
+
+    results = run(options)
+    width = max(len(result['benchmark']) for result in results)
+    print('{:<{}}  {:>9}  {:>9}  {:>9}'.format('benchmark', width, 'seconds', 'peak MB', 'API calls'))
+    for result in results:
+        print('{benchmark:<{width}}  {seconds:>9.3f}  {peak_mb:>9.2f}  {api_calls:>9}'.format(width=width, **result))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -64,5 +64,9 @@ setup(
         'Programming Language :: Python :: 3.7',
     ],
     keywords='robot framework testing automation Owasp Zap penetest security softwaretesting',
-    install_requires=['future', 'robotframework >= 2.6.0']
+    install_requires=['future', 'robotframework >= 2.6.0'],
+    extras_require={
+        'events': ['websocket-client'],
+        'memory': ['psutil'],
+    }
 )
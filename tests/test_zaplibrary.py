@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""
+ZAP Library tests, run against the local fake ZAP API of ``benchmarks/fake_zap.py``.
+
+    python -m pytest tests
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+from fake_zap import FakeZap  # noqa: E402
+from zapLibrary import _claim_slot, _pid_alive, _ScanWaiter, _take_over, zapLibrary  # noqa: E402
+
+TARGET = 'http://target'
+
+
+@pytest.fixture
+def zap():
+    server = FakeZap(scan_seconds=0.2, alerts=20, evidence_bytes=8).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def library(zap):
+    library = zapLibrary('', zap.proxy)
+    library.set_scan_wait_options(initial='10ms', maximum='50ms', use_events=False)
+    return library
+
+
+def test_alert_changes_since_baseline(zap, library, tmpdir):
+    baseline = str(tmpdir.join('baseline.json'))
+    assert library.save_zap_alert_baseline(TARGET, baseline) == 20
+
+    zap.alerts = 25
+    changes = library.get_zap_alert_changes(TARGET, baseline)
+    assert sorted(int(alert['id']) for alert in changes['new']) == list(range(20, 25))
+    assert changes['resolved'] == []
+
+    zap.alerts = 15
+    changes = library.get_zap_alert_changes(TARGET, baseline)
+    assert changes['new'] == []
+    assert sorted(alert['param'] for alert in changes['resolved']) == ['param{}'.format(i) for i in range(5, 10)]
+    assert set(changes['resolved'][0]) == set(['pluginId', 'name', 'risk', 'url', 'param', 'method'])
+
+
+
+def test_waiter_timeout_calls_on_timeout():
+    stopped = []
+    waiter = _ScanWaiter(initial=0.01, maximum=0.01)
+    with pytest.raises(AssertionError) as error:
+        waiter.wait('Task', lambda: '42', lambda status: status == '100', timeout=0.05,
+                    on_timeout=lambda: stopped.append(True))
+    assert stopped == [True]
+    assert 'last status: 42' in str(error.value)
+
+
+def test_scan_keywords_stop_the_scan_on_timeout(zap, library):
+    zap.scan_seconds = 60
+    with pytest.raises(AssertionError):
+        library.perform_spider_scan(TARGET, timeout='100ms')
+    assert zap.calls['JSON/spider/action/stop'] == 1
+
+
+def test_active_scan_timeout_stops_the_scan(zap, library):
+    zap.scan_seconds = 60
+    with pytest.raises(AssertionError):
+        library.perform_url_active_scan(TARGET, timeout='100ms')
+    assert zap.calls['JSON/ascan/action/stop'] == 1
+
+
+def test_active_scans_timeout_returns_results(zap, library):
+    zap.scan_seconds = 60
+    results = library.perform_active_scans(['{}/{}'.format(TARGET, i) for i in range(3)], concurrency=2,
+                                           timeout='100ms')
+    assert [result['status'] for result in results] == ['TIMEOUT'] * 3
+    assert zap.calls['JSON/ascan/action/stop'] == 2
+
+
+def test_active_scans_finish_removed_scans(zap, library):
+    zap.scan_seconds = 60
+    threading.Timer(0.1, zap.scans.clear).start()
+    results = library.perform_active_scans([TARGET, TARGET], concurrency=2, timeout='5s')
+    assert [result['status'] for result in results] == ['FAILED: scan removed from ZAP'] * 2
+
+
+def test_active_scans_of_a_single_target(zap, library):
+    results = library.perform_active_scans(TARGET)
+    assert [(result['target'], result['status']) for result in results] == [(TARGET, 'FINISHED')]
+    assert zap.calls['JSON/ascan/action/scan'] == 1
+
+
+def test_alerts_are_paged(zap, library):
+    batches = list(library.get_zap_alert_batches(TARGET, page_size=7))
+    assert [len(batch) for batch in batches] == [7, 7, 6]
+    assert len(library.get_zap_alerts(TARGET, 'High', page_size=3)) == 5
+
+
+@pytest.mark.parametrize('page_size', [0, -1])
+def test_alert_page_size_below_one_is_rejected(library, page_size):
+    with pytest.raises(ValueError):
+        library.get_zap_alert_batches(TARGET, page_size=page_size)
+    with pytest.raises(ValueError):
+        library.get_zap_alerts(TARGET, page_size=page_size)
+
+
+def test_alert_summary(zap, library):
+    summary = library.get_zap_alert_summary(TARGET)
+    assert summary['total'] == 20
+    assert summary['risk'] == {'Informational': 5, 'Low': 5, 'Medium': 5, 'High': 5}
+    assert summary['confidence'] == {'Low': 5, 'Medium': 5, 'High': 5, 'Confirmed': 5}
+    assert summary['pluginId'] == {'40012': 4, '40018': 4, '10020': 4, '10021': 4, '10038': 4}
+    assert zap.calls['JSON/core/view/alerts'] == 0
+
+
+def test_alert_summary_without_alerts_by_risk(zap, library):
+    zap.alerts_by_risk = False
+    summary = library.get_zap_alert_summary(TARGET)
+    assert summary['pluginId'] == {'40012': 4, '40018': 4, '10020': 4, '10021': 4, '10038': 4}
+    assert zap.calls['JSON/core/view/alerts'] == 1
+
+
+def test_alerts_should_not_exceed(library):
+    library.zap_alerts_should_not_exceed(TARGET, High=5, total=20)
+    with pytest.raises(AssertionError) as error:
+        library.zap_alerts_should_not_exceed(TARGET, high=4, Low=5, total=19)
+    assert 'high alerts: 5 > 4' in str(error.value)
+    assert 'total alerts: 20 > 19' in str(error.value)
+    assert 'Low' not in str(error.value)
+
+
+def test_save_report(zap, library, tmpdir):
+    zap.report_bytes = 100000
+    path = tmpdir.join('report.html')
+    assert library.save_zap_report(str(path), chunk_size=4096) == 100000
+    assert path.read_binary() == b'x' * 100000
+    assert tmpdir.listdir() == [path]
+
+
+def test_save_report_gzip(zap, library, tmpdir):
+    zap.report_bytes = 100000
+    path = str(tmpdir.join('report.json.gz'))
+    assert library.save_zap_report(path, 'json') == 100000
+    with gzip.open(path) as f:
+        assert f.read() == b'x' * 100000
+
+
+def test_failed_report_keeps_the_previous_one(zap, library, tmpdir):
+    zap.report_bytes = 1000000
+    zap.truncate_reports = True
+    path = tmpdir.join('report.html')
+    path.write('previous')
+    with pytest.raises(Exception):
+        library.save_zap_report(str(path))
+    assert path.read() == 'previous'
+    assert tmpdir.listdir() == [path]
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _zap_script(tmpdir, body):
+    script = tmpdir.join('zap.sh')
+    script.write('#!/bin/sh\n' + body + '\n')
+    script.chmod(0o755)
+    return str(tmpdir)
+
+
+def _ended(pid, seconds=5):
+    deadline = time.time() + seconds
+    while _pid_alive(pid) and time.time() < deadline:
+        time.sleep(0.05)
+    return not _pid_alive(pid)
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='uses a shell script as ZAP')
+def test_start_timeout_kills_zap_and_closes_the_log(tmpdir):
+    library = zapLibrary('', 'http://127.0.0.1:{}'.format(_free_port()), retries=0)
+    path = _zap_script(tmpdir, 'echo "$@"\nsleep 30 &\necho $!\nwait')
+    log = tmpdir.join('zap.log')
+    with pytest.raises(AssertionError):
+        library.start_headless_zap(path, timeout='500ms', log_file=str(log), config='api.addrs.addr.name=.*')
+    assert library._zap_process is None
+    assert library._zap_log is None
+    arguments, child = log.read().splitlines()[:2]
+    assert arguments.count('-config') == 3
+    assert '-config api.addrs.addr.name=.*' in arguments
+    assert _ended(int(child))
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='uses a shell script as ZAP')
+def test_start_fails_when_zap_exits(tmpdir):
+    library = zapLibrary('', 'http://127.0.0.1:{}'.format(_free_port()), retries=0)
+    with pytest.raises(RuntimeError) as error:
+        library.start_headless_zap(_zap_script(tmpdir, 'exit 3'), timeout='5s')
+    assert 'exited with code 3' in str(error.value)
+    assert library._zap_process is None
+    assert library._zap_log is None
+
+
+def test_start_fails_when_the_port_is_in_use(zap, tmpdir):
+    library = zapLibrary('', zap.proxy)
+    with pytest.raises(RuntimeError) as error:
+        library.start_headless_zap(str(tmpdir))
+    assert 'already in use' in str(error.value)
+
+
+def _ended_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_claim_slot_is_exclusive(tmpdir):
+    directory = str(tmpdir.join('claims'))
+    assert _claim_slot(directory, [8090, 8091], 0)[0] == 8090
+    assert _claim_slot(directory, [8090, 8091], 0)[0] == 8091
+    with pytest.raises(RuntimeError):
+        _claim_slot(directory, [8090, 8091], 1)
+
+
+def test_claim_slot_takes_over_stale_claims(tmpdir):
+    tmpdir.join('8090.claim').write(str(_ended_pid()))
+    tmpdir.join('8091.claim').write(str(os.getpid()))
+
+    slot, claim = _claim_slot(str(tmpdir), [8090, 8091], 1)
+    assert slot == 8090
+    assert tmpdir.join('8090.claim').read() == str(os.getpid())
+    assert sorted(path.basename for path in tmpdir.listdir()) == ['8090.claim', '8091.claim']
+
+
+def test_take_over_never_removes_a_new_claim(tmpdir):
+    # two workers saw the same stale claim, the first one took it over before the second one
+    claim = tmpdir.join('8090.claim')
+    dead = str(_ended_pid())
+    claim.write(dead)
+    assert _claim_slot(str(tmpdir), [8090], 0)[0] == 8090
+    assert not _take_over(str(claim), dead)
+    assert claim.read() == str(os.getpid())
+
+    claim.write(dead)
+    tmpdir.join('8090.claim.{}.takeover'.format(dead)).write(dead)
+    assert not _take_over(str(claim), dead)
+    assert claim.read() == dead
+
+
+def test_browser_proxy_defaults_to_the_library_proxy_port():
+    library = zapLibrary('', 'http://localhost:8095')
+    assert library._browser_proxy(None, None) == ('localhost', 8095)
+    assert library._browser_proxy('zap.local', None) == ('zap.local', 8095)
+    assert library._browser_proxy('zap.local', '8096') == ('zap.local', '8096')
+
+
+def test_validate_status_code(zap):
+    assert zapLibrary('', zap.proxy).zap.core.urls() is not None
+    with pytest.raises(Exception) as error:
+        zapLibrary('', zap.proxy, validate_status_code=True).zap.core.urls()
+    assert 'bad request: 400' in str(error.value)
+    assert zapLibrary('', zap.proxy, validate_status_code='True').zap.core.version == 'fake'
+
+
+@pytest.mark.parametrize('scanners', ['10020, 10021', ['10020', 10021]])
+def test_passive_scan_restricts_and_restores_scanners(zap, library, monkeypatch, scanners):
+    zap.passive_scanners['10038'] = False
+    enabled = []
+    records = type(library.zap.pscan).records_to_scan
+
+    def records_to_scan(pscan):
+        enabled.append(sorted(scanner for scanner, on in zap.passive_scanners.items() if on))
+        return records.fget(pscan)
+
+    monkeypatch.setattr(type(library.zap.pscan), 'records_to_scan', property(records_to_scan))
+    assert library.wait_for_passive_scan(scanners=scanners)['records'] == 0
+    assert enabled == [['10020', '10021']]
+    assert zap.passive_scanners == {'10020': True, '10021': True, '10038': False, '10202': True}
+
+
+def test_passive_scan_timeout_restores_scanners(zap, library):
+    zap.passive_records, zap.passive_rate = 1000, 0
+    zap.passive_scanners['10038'] = False
+    with pytest.raises(AssertionError):
+        library.wait_for_passive_scan(timeout='100ms', scanners='10020')
+    assert zap.passive_scanners == {'10020': True, '10021': True, '10038': False, '10202': True}
+
+
+@pytest.mark.parametrize('scanners', ['40012, 40018', ['40012', 40018]])
+def test_create_scan_policy(zap, library, scanners):
+    library.create_zap_scan_policy('forms', scanners, attack_strength='low')
+    policy = zap.policies['forms']
+    assert policy['attackStrength'] == 'LOW'
+    assert policy['scanners'] == {'40012': {'enabled': True, 'attackStrength': 'LOW'}, '40014': {'enabled': False},
+                                  '40018': {'enabled': True, 'attackStrength': 'LOW'}, '40019': {'enabled': False}}
+
+    library.create_zap_scan_policy('forms', alert_threshold='high')
+    assert zap.calls['JSON/ascan/action/addScanPolicy'] == 1
+    assert zap.calls['JSON/ascan/action/updateScanPolicy'] == 1
+    assert policy['alertThreshold'] == 'HIGH'
+
+
+def test_timing_report(zap, library, tmpdir):
+    library.perform_url_active_scan(TARGET)
+    library.get_zap_alerts(TARGET)
+    library.save_zap_timing_report(str(tmpdir.join('timings.json')))
+    library.save_zap_timing_report(str(tmpdir.join('timings.txt')), 'CSV')
+
+    timings = json.loads(tmpdir.join('timings.json').read())
+    assert set(timings) == set(['started', 'seconds', 'keywords', 'api_calls', 'scanners', 'memory'])
+    assert timings['api_calls']['JSON/ascan/action/scan/']['count'] == 1
+    assert len(timings['scanners']) == 5
+    assert timings['scanners'][0]['requests'] == 100
+
+    with io.open(str(tmpdir.join('timings.txt')), newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert set(row['section'] for row in rows) == set(['api_call', 'scanner'])
+    assert len([row for row in rows if row['section'] == 'scanner']) == 5
+
+    library.reset_zap_timings()
+    assert library._timings.as_dict()['api_calls'] == {}
+    with pytest.raises(ValueError):
+        library.save_zap_timing_report(str(tmpdir.join('timings.xml')))
+
+
+def test_timing_report_records_only_library_keywords(zap, tmpdir):
+    robot = pytest.importorskip('robot')
+    report = tmpdir.join('timings.json')
+    tmpdir.join('timings.robot').write('''*** Settings ***
+Library    zapLibrary    ${EMPTY}    %s    AS    ZAP
+
+*** Test Cases ***
+Timings
+    ZAP.Get Zap Alert Total    %s
+    Get Zap Alert Total    %s
+    Save Zap Timing Report    %s
+
+*** Keywords ***
+Get Zap Alert Total
+    [Arguments]    ${url}
+    No Operation
+''' % (zap.proxy, TARGET, TARGET, report))
+    assert robot.run(str(tmpdir.join('timings.robot')), pythonpath=[ROOT], output=None, log=None, report=None,
+                     stdout=io.StringIO()) == 0
+    keywords = json.loads(report.read())['keywords']
+    assert [(name, entry['count']) for name, entry in keywords.items()] == [('Get Zap Alert Total', 1)]
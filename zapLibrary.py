@@ -8,12 +8,612 @@
 ZAP Library - Robot keywords to access OWASP ZAP testing library.
 """
 
+import csv
+import errno
+import gzip
+import hashlib
+import io
+import json
+import math
 import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
 import time
 from logging import info, warn
+from multiprocessing.pool import ThreadPool
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from robot.libraries.BuiltIn import BuiltIn, RobotNotRunningError
+from robot.utils import timestr_to_secs
 from selenium import webdriver
 from zapv2 import ZAPv2
 
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RISK_LEVELS = ('Informational', 'Low', 'Medium', 'High')
+CONFIDENCE_LEVELS = ('False Positive', 'Low', 'Medium', 'High', 'Confirmed')
+REPORT_FORMATS = {'html': 'htmlreport', 'xml': 'xmlreport', 'json': 'jsonreport', 'md': 'mdreport',
+                  'markdown': 'mdreport'}
+ASCAN_EVENTS = 'org.zaproxy.zap.extension.ascan.ActiveScanEventPublisher'
+SPIDER_EVENTS = 'org.zaproxy.zap.extension.spider.SpiderEventPublisher'
+
+
+class _ZapEventStream(object):
+    """Listens on the ZAP websocket event stream for a scan completion event.
+
+    The websocket-client package is optional, when it is missing or ZAP does not
+    accept the connection the stream is simply not opened and callers keep polling.
+    """
+
+    def __init__(self, connection, scanid=None, event_type='scan.completed'):
+        self.connection = connection
+        self.scanid = None if scanid is None else str(scanid)
+        self.event_type = event_type
+
+    @classmethod
+    def open(cls, proxy, apikey, publisher, scanid=None):
+        if websocket is None:
+            return None
+        url = proxy.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1).rstrip('/') + '/'
+        if apikey:
+            url += '?apikey={}'.format(apikey)
+        try:
+            connection = websocket.create_connection(url, timeout=5)
+            connection.send(json.dumps({'component': 'event', 'type': 'register', 'name': publisher}))
+        except Exception as e:
+            info('ZAP event stream not available, polling only: {}'.format(e))
+            return None
+        return cls(connection, scanid)
+
+    def wait(self, seconds):
+        """Waits up to ``seconds`` for the completion event, returns True when it arrives."""
+        deadline = time.time() + seconds
+        while self.connection is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                self.connection.settimeout(remaining)
+                event = json.loads(self.connection.recv())
+            except websocket.WebSocketTimeoutException:
+                return False
+            except Exception as e:
+                info('ZAP event stream closed, polling only: {}'.format(e))
+                self.close()
+                break
+            if event.get('event.type') != self.event_type:
+                continue
+            if self.scanid is None or str(event.get('scanId')) == self.scanid:
+                return True
+        remaining = deadline - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        return False
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+class _ScanWaiter(object):
+    """Waits for a long running ZAP task, polling its status with an adaptive backoff.
+
+    The first polls are ``initial`` seconds apart, each following interval grows by
+    ``factor`` up to ``maximum``. When an event stream is given the time between
+    polls is spent listening for the completion event instead of sleeping.
+    """
+
+    def __init__(self, initial=0.5, maximum=5.0, factor=1.5, timeout=None):
+        self.initial = float(initial)
+        self.maximum = float(maximum)
+        self.factor = float(factor)
+        self.timeout = timeout
+
+    def wait(self, name, probe, is_done, events=None, timeout=None, on_timeout=None):
+        """Calls ``probe`` once per tick until ``is_done`` accepts its value, which is returned.
+
+        When ``timeout`` is reached ``on_timeout`` is called, to stop the task, before failing.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        interval = self.initial
+        start = time.time()
+        polls = 0
+        try:
+            while True:
+                status = probe()
+                polls += 1
+                if is_done(status):
+                    break
+                elapsed = time.time() - start
+                if timeout is not None and elapsed >= timeout:
+                    if on_timeout is not None:
+                        on_timeout()
+                    raise AssertionError('{} did not finish within {} seconds, last status: {}'
+                                         .format(name, timeout, status))
+                info('{} progress: {}'.format(name, status))
+                delay = interval if timeout is None else min(interval, timeout - elapsed)
+                if events is not None:
+                    events.wait(delay)
+                else:
+                    time.sleep(delay)
+                interval = min(interval * self.factor, self.maximum)
+        finally:
+            if events is not None:
+                events.close()
+        info('{} complete in {:.1f} seconds, {} status calls'.format(name, time.time() - start, polls))
+        return status
+
+
+class _ActiveScanBatch(object):
+    """Runs active scans over several targets keeping at most ``concurrency`` of them running.
+
+    All running scans are monitored with a single ``ascan.scans`` call per tick.
+    """
+
+    def __init__(self, zap, targets, concurrency, policy=None):
+        self.zap = zap
+        self.policy = policy
+        self.concurrency = max(1, int(concurrency))
+        self.running = {}
+        if not isinstance(targets, (list, tuple)):
+            targets = [targets]
+        self.results = [{'target': target, 'scanid': None, 'status': 'QUEUED', 'progress': 0,
+                         'seconds': None} for target in targets]
+        self._queue = list(self.results)
+
+    def _start(self, result):
+        target = result['target']
+        if str(target).isdigit():
+            scanid = self.zap.ascan.scan(contextid=target, scanpolicyname=self.policy)
+        else:
+            scanid = self.zap.ascan.scan(target, scanpolicyname=self.policy)
+        result['started'] = time.time()
+        if not str(scanid).isdigit():
+            result['status'] = 'FAILED: {}'.format(scanid)
+            result['seconds'] = 0.0
+            return
+        info('Active scan {} started for {}'.format(scanid, target))
+        result['scanid'] = str(scanid)
+        result['status'] = 'RUNNING'
+        self.running[str(scanid)] = result
+
+    def _end(self, result, status):
+        result['status'] = status
+        result['seconds'] = round(time.time() - result['started'], 3)
+        del self.running[result['scanid']]
+
+    def tick(self):
+        """Updates running scans, starts queued ones, returns the number of unfinished targets."""
+        if self.running:
+            missing = set(self.running)
+            for scan in self.zap.ascan.scans:
+                result = self.running.get(str(scan.get('id')))
+                if result is None:
+                    continue
+                missing.discard(result['scanid'])
+                result['progress'] = int(scan.get('progress', 0))
+                if result['progress'] >= 100 or scan.get('state') == 'FINISHED':
+                    self._end(result, 'FINISHED')
+            for scanid in missing:
+                warn('Active scan {} is no longer known by ZAP'.format(scanid))
+                self._end(self.running[scanid], 'FAILED: scan removed from ZAP')
+        while self._queue and len(self.running) < self.concurrency:
+            self._start(self._queue.pop(0))
+        return len(self._queue) + len(self.running)
+
+    def stop(self):
+        """Stops the running scans in ZAP and marks them, and the queued targets, as timed out."""
+        for scanid, result in list(self.running.items()):
+            self.zap.ascan.stop(scanid)
+            self._end(result, 'TIMEOUT')
+        for result in self._queue:
+            result['status'] = 'TIMEOUT'
+        self._queue = []
+
+
+class _Timings(object):
+    """Collects the time spent in the library keywords, the ZAP API calls and the active scanners."""
+
+    TABLE = ('count', 'total_seconds', 'max_seconds')
+    CSV_FIELDS = ('section', 'name', 'count', 'total_seconds', 'max_seconds', 'requests', 'alerts', 'bytes')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.keywords = {}
+        self.api_calls = {}
+        self.scanners = []
+        self.memory = None
+
+    def _add(self, table, name, seconds):
+        with self._lock:
+            entry = table.setdefault(name, dict.fromkeys(self.TABLE, 0))
+            entry['count'] += 1
+            entry['total_seconds'] += seconds
+            entry['max_seconds'] = max(entry['max_seconds'], seconds)
+
+    def keyword(self, name, seconds):
+        self._add(self.keywords, name, seconds)
+
+    def api_call(self, name, seconds):
+        self._add(self.api_calls, name, seconds)
+
+    def memory_sample(self, size):
+        """Aggregates the ZAP memory samples into their count, maximum and last value."""
+        if size is None:
+            return
+        with self._lock:
+            if self.memory is None:
+                self.memory = {'samples': 0, 'max_bytes': 0}
+            self.memory['samples'] += 1
+            self.memory['max_bytes'] = max(self.memory['max_bytes'], size)
+            self.memory['last_bytes'] = size
+            self.memory['last_seconds'] = round(time.time() - self.started, 3)
+
+    def scan_progress(self, scanid, progress):
+        """Records the duration, requests and alerts of each scanner of an ``ascan.scanProgress`` response."""
+        if isinstance(progress, list):
+            for item in progress:
+                self.scan_progress(scanid, item)
+        elif isinstance(progress, dict):
+            plugin = progress.get('Plugin')
+            if isinstance(plugin, list) and len(plugin) >= 6:
+                self.scanners.append({'scanid': str(scanid), 'name': plugin[0], 'id': plugin[1], 'status': plugin[3],
+                                      'seconds': int(plugin[4]) / 1000.0, 'requests': int(plugin[5]),
+                                      'alerts': int(plugin[6]) if len(plugin) > 6 else None})
+            else:
+                for value in progress.values():
+                    self.scan_progress(scanid, value)
+
+    def as_dict(self):
+        return {'started': self.started, 'seconds': round(time.time() - self.started, 3),
+                'keywords': self.keywords, 'api_calls': self.api_calls, 'scanners': self.scanners,
+                'memory': self.memory}
+
+    def rows(self):
+        for section, table in (('keyword', self.keywords), ('api_call', self.api_calls)):
+            for name, entry in sorted(table.items()):
+                yield dict(entry, section=section, name=name)
+        for scanner in self.scanners:
+            yield {'section': 'scanner', 'name': '{} {} ({})'.format(scanner['scanid'], scanner['name'], scanner['id']),
+                   'count': 1, 'total_seconds': scanner['seconds'], 'max_seconds': scanner['seconds'],
+                   'requests': scanner['requests'], 'alerts': scanner['alerts']}
+        if self.memory:
+            yield {'section': 'memory', 'name': 'zap', 'count': self.memory['samples'],
+                   'total_seconds': self.memory['last_seconds'], 'bytes': self.memory['max_bytes']}
+
+    def summary(self, top=5):
+        lines = ['ZAP Library timings over {:.1f} seconds'.format(time.time() - self.started)]
+        for title, table in (('Keywords', self.keywords), ('ZAP API calls', self.api_calls)):
+            slowest = sorted(table.items(), key=lambda item: -item[1]['total_seconds'])[:top]
+            lines += ['{}:'.format(title)] + ['  {}: {count} calls, {total_seconds:.3f}s total, {max_seconds:.3f}s max'
+                                             .format(name, **entry) for name, entry in slowest]
+        slowest = sorted(self.scanners, key=lambda scanner: -scanner['seconds'])[:top]
+        lines += ['Scanners:'] + ['  {name} ({id}): {seconds:.1f}s, {requests} requests'.format(**scanner)
+                                  for scanner in slowest]
+        if self.memory:
+            lines.append('ZAP memory: {max_bytes} bytes max, {last_bytes} bytes last, {samples} samples'
+                         .format(**self.memory))
+        return '\n'.join(lines)
+
+
+class _TimingListener(object):
+    """Robot Framework listener recording the elapsed time of the library keywords.
+
+    Keywords of other libraries and user keywords with the same name as a library keyword are
+    not recorded: the library a keyword comes from must be ``library``, whatever its alias.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 2
+
+    def __init__(self, timings, keywords, library):
+        self.timings = timings
+        self.keywords = set(_normalize(keyword) for keyword in keywords)
+        self.library = library
+        self._libraries = {}
+
+    def _is_library(self, libname):
+        if libname not in self._libraries:
+            try:
+                self._libraries[libname] = BuiltIn().get_library_instance(libname) is self.library
+            except (RuntimeError, RobotNotRunningError):
+                self._libraries[libname] = False
+        return self._libraries[libname]
+
+    def end_keyword(self, name, attrs):
+        if _normalize(attrs.get('kwname', '')) in self.keywords and self._is_library(attrs.get('libname')):
+            self.timings.keyword(attrs['kwname'], attrs.get('elapsedtime', 0) / 1000.0)
+
+
+def _normalize(name):
+    return name.lower().replace(' ', '').replace('_', '')
+
+
+class _PooledZAPv2(ZAPv2):
+    """ZAP API client sending all its requests through one keep-alive ``requests.Session``.
+
+    As ``ZAPv2``, it raises an exception on a 3xx, 4xx or 5xx answer when ``validate_status_code`` is true.
+    """
+
+    def __init__(self, session, proxies, apikey=None, timeout=None, timings=None, validate_status_code=False):
+        super(_PooledZAPv2, self).__init__(proxies=proxies, apikey=apikey)
+        self._session = session
+        self._proxies = proxies
+        self._apikey = apikey
+        self._timeout = timeout
+        self._timings = timings
+        self._validate_status_code = validate_status_code
+
+    def _request_api(self, url, query=None, method='GET', body=None, stream=False):
+        if not url.startswith('http://zap/'):
+            # Only allow requests to the API so that we never leak the apikey
+            raise ValueError('A non ZAP API url was specified ' + url)
+        headers = {'X-ZAP-API-Key': self._apikey} if self._apikey is not None else None
+        start = time.time()
+        try:
+            response = self._session.request(method, url, params=query, data=body, headers=headers,
+                                             proxies=self._proxies, verify=False, timeout=self._timeout,
+                                             stream=stream)
+        finally:
+            if self._timings is not None:
+                self._timings.api_call(url[len('http://zap/'):], time.time() - start)
+        if self._validate_status_code and 300 <= response.status_code < 500:
+            raise Exception('Non-successful status code returned from ZAP, which indicates a bad request: '
+                            '{} response: {}'.format(response.status_code, response.text))
+        if self._validate_status_code and response.status_code >= 500:
+            raise Exception('Non-successful status code returned from ZAP, which indicates a ZAP internal error: '
+                            '{} response: {}'.format(response.status_code, response.text))
+        return response
+
+
+def _zap_session(pool_size, retries):
+    """Returns a keep-alive session retrying failed connections to ZAP, but never a request ZAP received."""
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=Retry(total=retries, connect=retries, read=0, status=0, backoff_factor=0.1))
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _level_id(value, levels):
+    """Returns the ZAP id of a risk or confidence given by name or id, None when not given."""
+    if value is None or str(value).upper() in ('', 'NONE'):
+        return None
+    if str(value).isdigit():
+        return int(value)
+    for level, name in enumerate(levels):
+        if name.upper() == str(value).upper():
+            return level
+    raise ValueError('Unknown level {}, expected one of {}'.format(value, ', '.join(levels)))
+
+
+def _count(counts, key):
+    counts[key] = counts.get(key, 0) + 1
+
+
+def _summarise_alerts_by_risk(node, summary, risk=None):
+    """Counts the alert instances of an ``alert.alertsByRisk`` response, returns False when
+    an instance lacks the fields needed for the summary."""
+    if isinstance(node, list):
+        return all([_summarise_alerts_by_risk(item, summary, risk) for item in node])
+    if not isinstance(node, dict):
+        return True
+    if 'pluginId' in node:
+        if 'confidence' not in node or risk is None:
+            return False
+        _count(summary['confidence'], node['confidence'])
+        _count(summary['pluginId'], str(node['pluginId']))
+        return True
+    return all([_summarise_alerts_by_risk(value, summary, key if key in RISK_LEVELS else risk)
+                for key, value in node.items()])
+
+
+def _alert_key(alert):
+    """Returns the baseline key of an alert, a short hash of its plugin id, url, parameter and method."""
+    identity = u'\0'.join(u'{}'.format(alert.get(field, '')) for field in ('pluginId', 'url', 'param', 'method'))
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+
+
+def _alert_entry(alert):
+    return [alert.get('pluginId'), alert.get('name', alert.get('alert')), alert.get('risk'),
+            alert.get('url'), alert.get('param'), alert.get('method')]
+
+
+class _CountingReader(object):
+    """Wraps a file like object counting the bytes read from it."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.size += len(data)
+        return data
+
+
+def _zap_executable(path):
+    """Returns the ZAP start script found in ``path``."""
+    for name in (('zap.bat', 'zap.exe') if os.name == 'nt' else ('zap.sh', 'zap')):
+        if os.path.isfile(os.path.join(path, name)):
+            return os.path.join(path, name)
+    raise IOError('The OWASP ZAP path is not correctly configured, no ZAP start script in {}'.format(path))
+
+
+def _worker_index():
+    """Returns the pabot execution pool id of this process, its pid when not run by pabot."""
+    try:
+        value = BuiltIn().get_variable_value('${PABOTEXECUTIONPOOLID}')
+    except RobotNotRunningError:
+        value = None
+    value = value or os.environ.get('PABOTEXECUTIONPOOLID')
+    return int(value) if str(value).isdigit() else os.getpid()
+
+
+def _pid_alive(pid):
+    """Tells if the process ``pid`` is still running."""
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows, ask its exit code instead
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED, running as another user
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _read_claim(claim):
+    """Returns the content of a claim file, None when it does not exist anymore."""
+    try:
+        with io.open(claim) as f:
+            return f.read()
+    except IOError:
+        return None
+
+
+def _claim_alive(claim):
+    """Tells if the process owning a claim file is still running."""
+    try:
+        with io.open(claim) as f:
+            pid = int(f.read())
+    except IOError:
+        return False
+    except ValueError:
+        # the owner may not have written its pid yet
+        try:
+            return time.time() - os.path.getmtime(claim) < 10
+        except OSError:
+            return False
+    return _pid_alive(pid)
+
+
+def _take_over(claim, owner):
+    """Removes a stale claim whose content was ``owner``, returns False when another process took it over.
+
+    The claim is first hard linked to a name made of its owner. Creating the link is atomic, so a
+    single process goes on for a given owner, and it only removes the claim when the linked file
+    still holds that owner: a claim created meanwhile by another process is never removed.
+    """
+    marker = '{}.{}.takeover'.format(claim, (owner or '').strip() or 'empty')
+    try:
+        os.link(claim, marker)
+    except OSError as e:
+        # a claim removed meanwhile can be created again
+        return e.errno == errno.ENOENT
+    try:
+        if _read_claim(marker) != owner:
+            return False
+        info('Taking over stale claim {}'.format(claim))
+        os.remove(claim)
+        return True
+    finally:
+        os.remove(marker)
+
+
+def _claim_slot(directory, slots, preferred):
+    """Claims one of ``slots``, starting from ``preferred``, by exclusively creating its claim file.
+
+    Creating the file is atomic so several processes can share the directory without locks.
+    Claims left by processes that are no longer running are taken over, see ``_take_over``.
+    """
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    for offset in range(len(slots)):
+        slot = slots[(preferred + offset) % len(slots)]
+        claim = os.path.join(directory, '{}.claim'.format(slot))
+        for attempt in range(2):
+            try:
+                fd = os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST or attempt:
+                    break
+                owner = _read_claim(claim)
+                if _claim_alive(claim) or not _take_over(claim, owner):
+                    break
+                continue
+            os.write(fd, str(os.getpid()).encode('ascii'))
+            os.close(fd)
+            return slot, claim
+    raise RuntimeError('All {} ZAP daemons of the pool in {} are in use'.format(len(slots), directory))
+
+
+def _ids(value):
+    """Returns scanner ids given as a list or as a comma separated string, joined with commas."""
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(item) for item in value)
+    return ','.join(item.strip() for item in str(value).split(',') if item.strip())
+
+
+def _minutes(value):
+    """Returns a Robot Framework time as whole minutes, rounded up."""
+    return int(math.ceil(timestr_to_secs(value) / 60.0))
+
+
+def _kill_zap(process):
+    """Kills a ZAP process started by the library, with the processes it started, and reaps it."""
+    try:
+        if os.name == 'nt':
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)])
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        process.kill()
+    process.wait()
+
+
+def _listening(host, port):
+    """Tells if something already accepts connections on ``host``:``port``."""
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+    except (socket.error, socket.timeout):
+        return False
+    return True
+
+
+def _optional_secs(value):
+    if value is None or str(value).upper() in ('', 'NONE'):
+        return None
+    return timestr_to_secs(value)
+
 
 class zapLibrary(object):
     """
@@ -55,7 +655,7 @@ class zapLibrary(object):
 
         = Importing =
 
-            ZAP Library can be imported with 2 argument.
+            ZAP Library can be imported with 2 argument, and optional settings of its connections to ZAP.
 
             Arguments:
 
@@ -63,30 +663,114 @@ class zapLibrary(object):
             This is a security feature to prevent malicious sites from invoking the ZAP API. Can be retrieved/removed
             in OWASP ZAP by accessing *Tools> API*.
             - ``proxy ``: URL where ZAP is listening, in this format http://<host>:<port>
+            - ``timeout ``: maximum time to wait for each ZAP API response, no limit by default
+            - ``retries ``: number of retries when the connection to ZAP fails
+            - ``pool_size ``: number of kept alive connections to ZAP
 
+            All the ZAP API calls share the same kept alive connections.
 
             *Example:*
 
 
-            | =Setting= |  =Value=   | =Argument= | =Argument= |
-            | Library   | ZapLibrary |   apikey   |    proxy   |
+            | =Setting= |  =Value=   | =Argument= | =Argument= | =Argument= |
+            | Library   | ZapLibrary |   apikey   |    proxy   |            |
+            | Library   | ZapLibrary |   apikey   |    proxy   | timeout=30s |
 
         """
     ROBOT_LIBRARY_VERSION = '0.1'
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
 
-    def __init__(self, apikey, proxy):
+    def __init__(self, apikey, proxy, timeout=None, retries=3, pool_size=10, validate_status_code=False):
         """ZAP Library can be imported with 2 argument.
         Arguments:
         - ``apikey ``: API key is required by default in order to invoke any of the API operations.
         This is a security feature to prevent malicious sites from invoking the ZAP API. Can be retrieved/removed
         in OWASP ZAP bym accessing *Tools> API*.
         - ``proxy ``: URL where ZAP is listening, in this format http://<host>:<port>
+        - ``timeout ``: maximum time to wait for each ZAP API response, no limit by default
+        - ``retries ``: number of retries when the connection to ZAP fails
+        - ``pool_size ``: number of kept alive connections to ZAP
+        - ``validate_status_code ``: fail the keywords when ZAP answers an API call with a 3xx, 4xx or 5xx status
         Examples:
         | = Keyword Definition =  | = Description =       |
         | Library `|` ZapLibrary | apikey | proxy|
         """
-        self.zap = ZAPv2(apikey=apikey, proxies={'http': proxy, 'https': proxy})
+        self._apikey = apikey
+        self._timeout = _optional_secs(timeout)
+        self._validate_status_code = str(validate_status_code).upper() not in ('FALSE', 'NO', 'OFF', '0', '')
+        self._timings = _Timings()
+        self.ROBOT_LIBRARY_LISTENER = _TimingListener(
+            self._timings, [name for name in dir(self) if not name.startswith('_') and callable(getattr(self, name))],
+            self)
+        self._pool_size = int(pool_size)
+        self._session = _zap_session(self._pool_size, int(retries))
+        self._connect(proxy)
+        self._waiter = _ScanWaiter()
+        self._use_events = True
+        self._zap_process = None
+        self._zap_log = None
+        self._zap_claim = None
+        self.zap_startup_time = None
+
+    def _connect(self, proxy):
+        """Binds the library to the ZAP listening on ``proxy``."""
+        self.zap = _PooledZAPv2(self._session, {'http': proxy, 'https': proxy}, self._apikey, self._timeout,
+                                self._timings, self._validate_status_code)
+        self._proxy = proxy
+
+    def _batch(self, *calls):
+        """Runs read only ZAP API calls concurrently over the kept alive connections, returns their results."""
+        if len(calls) < 2:
+            return [call() for call in calls]
+        pool = ThreadPool(min(len(calls), self._pool_size))
+        try:
+            return pool.map(lambda call: call(), calls)
+        finally:
+            pool.close()
+
+    def get_zap_values(self, *views):
+        """Returns the values of several ZAP API views without arguments, requesting them concurrently.
+
+        Arguments:
+
+        - ``views``: ZAP API views, as component.view like in the ZAP python client
+
+        *Example:*
+
+        | ${version} | ${records} | ${scans}= | Get Zap Values | core.version | pscan.records_to_scan | ascan.scans |
+        """
+        def view(name):
+            component, attribute = name.split('.', 1)
+            value = getattr(getattr(self.zap, component), attribute)
+            return value() if callable(value) else value
+        return self._batch(*[lambda name=name: view(name) for name in views])
+
+    def _events(self, publisher, scanid=None):
+        if not self._use_events:
+            return None
+        return _ZapEventStream.open(self._proxy, self._apikey, publisher, scanid)
+
+    def set_scan_wait_options(self, initial='0.5s', maximum='5s', factor=1.5, timeout=None, use_events=True):
+        """Configures how the library waits for long running scans (active scan, spider, ajax spider).
+
+        Status is polled every ``initial`` at first, the interval grows by ``factor`` after each
+        poll up to ``maximum``, so short scans finish fast and long scans do not flood ZAP.
+
+        Arguments:
+
+        - ``initial``: first interval between status calls, in Robot Framework time format
+        - ``maximum``: longest interval between status calls
+        - ``factor``: growth of the interval after each status call
+        - ``timeout``: default maximum duration of a scan, ``None`` waits forever
+        - ``use_events``: listen on the ZAP event stream for scan completion, needs the websocket-client package
+
+        *Example:*
+
+        | Set Scan Wait Options | initial=1s | maximum=10s | timeout=30 minutes |
+        """
+        self._waiter = _ScanWaiter(timestr_to_secs(initial), timestr_to_secs(maximum), float(factor),
+                                   _optional_secs(timeout))
+        self._use_events = str(use_events).upper() not in ('FALSE', 'NO', 'OFF', '0', '')
 
     # Create a new Session
     def create_new_session(self):
@@ -102,28 +786,382 @@ class zapLibrary(object):
     def vitor(self):
         print('Create a new Session')
 
-    def perform_url_active_scan(self, url):
+    def perform_url_active_scan(self, url, timeout=None, policy=None):
         """Runs the active scanner against the given URL and/or Context.
         The scans ends when their status reach 100%
 
+        Arguments:
+
+        - ``url``: Url to be scanned, should be in ths format: http(s)://<address>
+        - ``timeout``: maximum duration of the scan, defaults to the one of `Set Scan Wait Options`,
+          the scan is stopped when it is reached
+        - ``policy``: scan policy, see `Create Zap Scan Policy`, ZAP default policy when not given
+
         *Example:*
 
         | Perform URL active scan | http://<address> |
+        | Perform URL active scan | http://<address> | timeout=20 minutes |
         """
         info('Begin Active scan {}'.format(url))
-        scanid = self.zap.ascan.scan(url)
-        info('Scan id: {}'.format(self.zap.ascan.scan(url)))
-        while int(self.zap.ascan.status(scanid)) < 100:
-            info('Scan progress %: {}'.format(self.zap.ascan.status(scanid)))
-            time.sleep(5)
-        info("Active scan is complete")
-
-    def get_zap_alerts(self, url):
+        scanid = self.zap.ascan.scan(url, scanpolicyname=policy)
+        self._wait_for_active_scan(scanid, timeout)
+
+    def perform_request_active_scan(self, url, method='GET', postdata=None, policy=None, contextid=None,
+                                    userid=None, timeout=None):
+        """Runs the active scanner against a single request of the ZAP history, without recursing into the site.
+
+        Arguments:
+
+        - ``url``: Url of the request, should be in ths format: http(s)://<address>
+        - ``method``: HTTP method of the request
+        - ``postdata``: body of the request, for POST requests
+        - ``policy``: scan policy, see `Create Zap Scan Policy`, ZAP default policy when not given
+        - ``contextid``: context of the scan, required with ``userid``
+        - ``userid``: user the scan is done as
+        - ``timeout``: maximum duration of the scan, defaults to the one of `Set Scan Wait Options`,
+          the scan is stopped when it is reached
+
+        *Example:*
+
+        | Perform Request Active Scan | ${URL}/login | POST | user=admin&pass=x | policy=forms |
+        """
+        info('Begin Active scan of {} {}'.format(method, url))
+        if userid is not None:
+            scanid = self.zap.ascan.scan_as_user(url, contextid, userid, recurse='false', scanpolicyname=policy,
+                                                 method=method, postdata=postdata)
+        else:
+            scanid = self.zap.ascan.scan(url, recurse='false', scanpolicyname=policy, method=method,
+                                         postdata=postdata, contextid=contextid)
+        self._wait_for_active_scan(scanid, timeout)
+
+    def _wait_for_active_scan(self, scanid, timeout):
+        if not str(scanid).isdigit():
+            raise AssertionError('Active scan not started: {}'.format(scanid))
+        info('Scan id: {}'.format(scanid))
+        self._waiter.wait('Active scan {}'.format(scanid),
+                          lambda: self.zap.ascan.status(scanid),
+                          lambda status: int(status) >= 100,
+                          self._events(ASCAN_EVENTS, scanid),
+                          _optional_secs(timeout),
+                          lambda: self.zap.ascan.stop(scanid))
+        self._record_scan_progress(scanid)
+        self._sample_zap_memory()
+
+    def _record_scan_progress(self, scanid):
+        try:
+            self._timings.scan_progress(scanid, self.zap.ascan.scan_progress(scanid))
+        except Exception as e:
+            info('Scan progress of scan {} not available: {}'.format(scanid, e))
+
+    def _sample_zap_memory(self):
+        """Records the memory used by the ZAP process started by the library, needs the psutil package.
+
+        Sampled once at the end of each scan and wait keyword, not after every keyword.
+        """
+        process = self._zap_process
+        if psutil is None or process is None or process.poll() is not None:
+            return
+        try:
+            root = psutil.Process(process.pid)
+            self._timings.memory_sample(sum(child.memory_info().rss
+                                            for child in [root] + root.children(recursive=True)))
+        except psutil.Error:
+            pass
+
+    def save_zap_timing_report(self, path, report_format=None):
+        """Saves the time spent in this library since it was imported, and logs a summary of it.
+
+        The report has the elapsed time of each keyword of the library, the number and latency of
+        the ZAP API calls, the duration and requests of each scanner of the active scans, and the
+        memory of the ZAP process started by `Start Headless Zap`, when the psutil package is installed.
+        The memory is sampled at the end of each scan and wait keyword and reported as the number
+        of samples, the maximum and the last value.
+
+        ZAP started outside of this library, as the daemons of `Use Zap Daemon Pool` or a ZAP
+        reached through the ``proxy`` import argument, has no memory figure: its process is not
+        known to the library.
+
+        Arguments:
+
+        - ``path``: file where the report is saved
+        - ``report_format``: json or csv, taken from the ``path`` extension when not given
+
+        *Example:*
+
+        | Suite Teardown | Save Zap Timing Report | ${OUTPUT DIR}${/}zap-timings.json |
+        """
+        report_format = (report_format or os.path.splitext(path)[1].lstrip('.') or 'json').lower()
+        if report_format not in ('json', 'csv'):
+            raise ValueError('Unknown timing report format {}, expected json or csv'.format(report_format))
+        self._sample_zap_memory()
+        if report_format == 'json':
+            with io.open(path, 'w', encoding='utf-8') as f:
+                f.write(u'{}'.format(json.dumps(self._timings.as_dict(), indent=2, sort_keys=True)))
+        else:
+            with io.open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, _Timings.CSV_FIELDS)
+                writer.writeheader()
+                writer.writerows(self._timings.rows())
+        info(self._timings.summary())
+
+    def reset_zap_timings(self):
+        """Discards the timings collected so far, see `Save Zap Timing Report`.
+
+        *Example:*
+
+        | Suite Setup | Reset Zap Timings |
+        """
+        self._timings.reset()
+
+    def create_zap_scan_policy(self, name, scanners=None, attack_strength=None, alert_threshold=None):
+        """Creates, or updates, a scan policy to be used by the active scan keywords.
+
+        Running only the scanners relevant for a test, at a low strength, makes active scans much shorter.
+
+        Arguments:
+
+        - ``name``: name of the scan policy
+        - ``scanners``: list, or comma separated string, of active scanner ids to enable, all others are
+          disabled, all are kept when not given
+        - ``attack_strength``: one of LOW, MEDIUM, HIGH or INSANE
+        - ``alert_threshold``: one of OFF, LOW, MEDIUM or HIGH
+
+        *Example:*
+
+        | @{SCANNERS}=            | Create List | 40012        | 40014              | 40018 |
+        | Create Zap Scan Policy  | forms       | ${SCANNERS}  | attack_strength=LOW |      |
+        | Perform URL Active Scan | ${URL}      | policy=forms |                     |      |
+        | Create Zap Scan Policy  | sqli        | 40018,40019  |                     |      |
+        """
+        attack_strength = attack_strength.upper() if attack_strength else None
+        alert_threshold = alert_threshold.upper() if alert_threshold else None
+        if name in self.zap.ascan.scan_policy_names:
+            self.zap.ascan.update_scan_policy(name, alert_threshold, attack_strength)
+        else:
+            self.zap.ascan.add_scan_policy(name, alert_threshold, attack_strength)
+        ids = _ids(scanners) if scanners else None
+        if ids:
+            self.zap.ascan.disable_all_scanners(name)
+            self.zap.ascan.enable_scanners(ids, name)
+            for scanner in ids.split(','):
+                if attack_strength:
+                    self.zap.ascan.set_scanner_attack_strength(scanner, attack_strength, name)
+                if alert_threshold:
+                    self.zap.ascan.set_scanner_alert_threshold(scanner, alert_threshold, name)
+        info('Scan policy {} ready, scanners: {}'.format(name, ids or 'all'))
+
+    def set_zap_active_scan_options(self, thread_per_host=None, max_rule_duration=None, max_scan_duration=None):
+        """Sets the ZAP options limiting the active scans, the options not given are left unchanged.
+
+        Arguments:
+
+        - ``thread_per_host``: number of threads scanning each host
+        - ``max_rule_duration``: maximum time spent by each scanner, rounded up to minutes, 0 for no limit
+        - ``max_scan_duration``: maximum time of a scan, rounded up to minutes, 0 for no limit
+
+        *Example:*
+
+        | Set Zap Active Scan Options | thread_per_host=8 | max_rule_duration=2 minutes | max_scan_duration=10 minutes |
+        """
+        if thread_per_host is not None:
+            self.zap.ascan.set_option_thread_per_host(int(thread_per_host))
+        if max_rule_duration is not None:
+            self.zap.ascan.set_option_max_rule_duration_in_mins(_minutes(max_rule_duration))
+        if max_scan_duration is not None:
+            self.zap.ascan.set_option_max_scan_duration_in_mins(_minutes(max_scan_duration))
+
+    def perform_active_scans(self, targets, concurrency=None, timeout=None, policy=None):
+        """Runs the active scanner against several URLs and/or Contexts, several at a time.
+
+        At most ``concurrency`` scans are running in ZAP at once, the next target is started as soon
+        as a running scan ends. All scans are monitored from a single polling loop.
+
+        Arguments:
+
+        - ``targets``: list of URLs in this format http(s)://<address>, or context ids. A single
+          URL or context id is scanned as the only target
+        - ``concurrency``: maximum of scans running at once, defaults to the ZAP hosts per scan option
+        - ``timeout``: maximum duration of the whole run, defaults to the one of `Set Scan Wait Options`.
+          When it is reached the running scans are stopped, and they and the queued targets get the TIMEOUT status
+        - ``policy``: scan policy, see `Create Zap Scan Policy`, ZAP default policy when not given
+
+        Returns a list with one dictionary per target, with keys ``target``, ``scanid``, ``status``,
+        ``progress`` and ``seconds``. The status is FINISHED, TIMEOUT or FAILED followed by the reason.
+
+        *Example:*
+
+        | @{RESULTS}= | Perform Active Scans | ${URLS} | concurrency=4 |
+        """
+        if concurrency is None:
+            concurrency = self.zap.ascan.option_host_per_scan
+        batch = _ActiveScanBatch(self.zap, targets, concurrency, policy)
+        info('Begin Active scans of {} targets, {} at a time'.format(len(batch.results), batch.concurrency))
+        start = time.time()
+        try:
+            self._waiter.wait('Active scans', batch.tick, lambda unfinished: unfinished == 0,
+                              timeout=_optional_secs(timeout), on_timeout=batch.stop)
+        except AssertionError as e:
+            warn(str(e))
+        info('Active scans ended in {:.1f} seconds'.format(time.time() - start))
+        for result in batch.results:
+            result.pop('started', None)
+            if result['scanid'] is not None:
+                self._record_scan_progress(result['scanid'])
+        self._sample_zap_memory()
+        return batch.results
+
+    def perform_spider_scan(self, url, timeout=None):
+        """Runs the spider against the given URL, the scan ends when its status reach 100%
+
+        Arguments:
+
+        - ``url``: Url to be crawled, should be in ths format: http(s)://<address>
+        - ``timeout``: maximum duration of the scan, defaults to the one of `Set Scan Wait Options`,
+          the scan is stopped when it is reached
+
+        *Example:*
+
+        | Perform Spider Scan | http://<address> |
+        """
+        info('Begin Spider scan {}'.format(url))
+        scanid = self.zap.spider.scan(url)
+        info('Scan id: {}'.format(scanid))
+        self._waiter.wait('Spider scan {}'.format(scanid),
+                          lambda: self.zap.spider.status(scanid),
+                          lambda status: int(status) >= 100,
+                          self._events(SPIDER_EVENTS, scanid),
+                          _optional_secs(timeout),
+                          lambda: self.zap.spider.stop(scanid))
+        self._sample_zap_memory()
+
+    def perform_ajax_spider_scan(self, url, timeout=None):
+        """Runs the AJAX spider against the given URL, the scan ends when the spider stops running.
+
+        Arguments:
+
+        - ``url``: Url to be crawled, should be in ths format: http(s)://<address>
+        - ``timeout``: maximum duration of the scan, defaults to the one of `Set Scan Wait Options`,
+          the scan is stopped when it is reached
+
+        *Example:*
+
+        | Perform Ajax Spider Scan | http://<address> |
+        """
+        info('Begin Ajax Spider scan {}'.format(url))
+        self.zap.ajaxSpider.scan(url)
+        self._waiter.wait('Ajax Spider scan',
+                          lambda: self.zap.ajaxSpider.status,
+                          lambda status: status != 'running',
+                          timeout=_optional_secs(timeout),
+                          on_timeout=self.zap.ajaxSpider.stop)
+        self._sample_zap_memory()
+
+    def wait_for_passive_scan(self, timeout=None, scanners=None):
+        """Waits until the ZAP passive scanner has no records left to scan.
+
+        Call it before retrieving alerts, after the browser navigation through the ZAP proxy, so the
+        alerts of the last requests are not missed. Records are polled with the adaptive backoff of
+        `Set Scan Wait Options`.
+
+        Arguments:
+
+        - ``timeout``: maximum time to wait, defaults to the one of `Set Scan Wait Options`
+        - ``scanners``: list, or comma separated string, of passive scanner ids to keep enabled while
+          waiting, all others are disabled to drain faster. The passive scanners enabled before are
+          restored once the wait ends
+
+        Returns a dictionary with the number of ``records`` found waiting, the ``seconds`` waited
+        and the drain throughput in ``records_per_second``.
+
+        *Example:*
+
+        | Wait For Passive Scan |             |
+        | Wait For Passive Scan | timeout=2 minutes | scanners=10020,10021 |
+        """
+        ids = _ids(scanners) if scanners else None
+        if ids:
+            enabled = ','.join(scanner['id'] for scanner in self.zap.pscan.scanners
+                               if str(scanner.get('enabled')).lower() == 'true')
+            self.zap.pscan.disable_all_scanners()
+            self.zap.pscan.enable_scanners(ids)
+            info('Passive scanners restricted to {}'.format(ids))
+        backlog = []
+        start = time.time()
+
+        def records():
+            backlog.append(int(self.zap.pscan.records_to_scan))
+            return backlog[-1]
+
+        try:
+            self._waiter.wait('Passive scan', records, lambda left: left == 0, timeout=_optional_secs(timeout))
+        finally:
+            if ids:
+                self.zap.pscan.disable_all_scanners()
+                if enabled:
+                    self.zap.pscan.enable_scanners(enabled)
+                info('Passive scanners {} enabled again'.format(enabled))
+        seconds = time.time() - start
+        self._sample_zap_memory()
+        drain = {'records': backlog[0], 'seconds': round(seconds, 3),
+                 'records_per_second': round(backlog[0] / seconds, 1) if seconds else 0.0}
+        info('Passive scan drained {records} records in {seconds} seconds, '
+             '{records_per_second} records per second'.format(**drain))
+        return drain
+
+    def get_zap_alert_batches(self, url, risk=None, confidence=None, page_size=500):
+        """Returns an iterator over the alerts raised by ZAP, filtering by URL, one page at a time.
+
+        Alerts are requested from ZAP in pages of ``page_size`` while iterating. Each item is a list
+        of at most ``page_size`` alerts.
+
+        The iterator is meant for Python code, like keywords of other libraries, which then keep
+        only one page in memory. A Robot Framework ``FOR`` loop first turns the iterator into a list,
+        so all the pages are held at once, as with `Get Zap Alerts`.
+
+        Arguments:
+
+        - ``url``: Url to be scanned, should be in ths format: http(s)://address
+        - ``risk``: only alerts of this risk, by name (Informational, Low, Medium, High) or id, filtered by ZAP
+        - ``confidence``: only alerts of this confidence, by name (False Positive, Low, Medium, High, Confirmed) or id
+        - ``page_size``: number of alerts requested to ZAP in each call, at least 1
+
+        *Example:*
+
+        | for batch in library.get_zap_alert_batches(url, risk='High'):
+        |     process(batch)
+        """
+        page_size = int(page_size)
+        if page_size < 1:
+            raise ValueError('Page size must be at least 1, got {}'.format(page_size))
+        return self._alert_pages(url, _level_id(risk, RISK_LEVELS), _level_id(confidence, CONFIDENCE_LEVELS),
+                                 page_size)
+
+    def _alert_pages(self, url, riskid, confidence, page_size):
+        start = 0
+        while True:
+            page = self.zap.core.alerts(url, start=start, count=page_size, riskid=riskid)
+            received = len(page)
+            start += received
+            if confidence is not None:
+                page = [alert for alert in page
+                        if _level_id(alert.get('confidence'), CONFIDENCE_LEVELS) == confidence]
+            if page:
+                yield page
+            if received < page_size:
+                break
+
+    def get_zap_alerts(self, url, risk=None, confidence=None, page_size=500):
         """Returns, in JSON format all alerts raised by ZAP, filtering by URL.
 
+         Alerts are requested in pages, see `Get Zap Alert Batches` to process them without
+         holding them all in memory.
+
          Arguments:
 
          - ``url``: Url to be scanned, should be in ths format: http(s)://address
+         - ``risk``: only alerts of this risk, by name (Informational, Low, Medium, High) or id
+         - ``confidence``: only alerts of this confidence, by name or id
+         - ``page_size``: number of alerts requested to ZAP in each call
 
          *Example 1:*
 
@@ -138,7 +1176,10 @@ class zapLibrary(object):
 
          """
         info('Retrieve all alerts')
-        return self.zap.core.alerts(url)
+        alerts = []
+        for batch in self.get_zap_alert_batches(url, risk, confidence, page_size):
+            alerts.extend(batch)
+        return alerts
 
     def get_zap_alert_total(self, url):
         """Returns quantity of alerts raised by ZAP, filtering by URL.
@@ -155,13 +1196,215 @@ class zapLibrary(object):
         info('Retrieve alerts {}'.format(qtyOfAlerts))
         return qtyOfAlerts
 
-    def shutdown_zap(self):
+    def get_zap_alert_summary(self, url, by_plugin=True):
+        """Returns the number of alerts raised by ZAP, filtering by URL, per risk, confidence and plugin.
+
+        Risk counts come from the ZAP alerts summary, confidence and plugin counts from the ZAP
+        alerts by risk view, which does not send the alert evidence. When that view is not available
+        the alerts are counted in a single pass over `Get Zap Alert Batches`.
+
+        Arguments:
+
+        - ``url``: Url to be scanned, should be in ths format: http(s)://<address>
+        - ``by_plugin``: also count per confidence and per plugin id, only risk counts are returned when False
+
+        Returns a dictionary with keys ``total``, ``risk``, ``confidence`` and ``pluginId``, each
+        but ``total`` holding a dictionary of counts.
+
+        *Example:*
+
+        | ${summary}= | Get Zap Alert Summary | ${URL}          |
+        | Should Be Equal As Integers | ${summary['risk']['High']} | 0 |
+        """
+        def alerts_by_risk():
+            try:
+                return self.zap.alert.alerts_by_risk(url, recurse=True)
+            except Exception as e:
+                info('Alerts by risk not available: {}'.format(e))
+
+        by_plugin = str(by_plugin).upper() not in ('FALSE', 'NO', 'OFF', '0', '')
+        calls = [lambda: self.zap.core.alerts_summary(url)] + ([alerts_by_risk] if by_plugin else [])
+        results = self._batch(*calls)
+        risk = dict((name, int(count)) for name, count in results[0].items())
+        summary = {'total': sum(risk.values()), 'risk': risk, 'confidence': {}, 'pluginId': {}}
+        if not by_plugin:
+            info('Alert summary {}'.format(summary))
+            return summary
+        complete = results[1] is not None and _summarise_alerts_by_risk(results[1], summary)
+        if not complete or sum(summary['pluginId'].values()) != summary['total']:
+            summary['confidence'], summary['pluginId'] = {}, {}
+            for batch in self.get_zap_alert_batches(url):
+                for alert in batch:
+                    _count(summary['confidence'], alert.get('confidence'))
+                    _count(summary['pluginId'], str(alert.get('pluginId')))
+        info('Alert summary {}'.format(summary))
+        return summary
+
+    def zap_alerts_should_not_exceed(self, url, **limits):
+        """Fails if ZAP raised more alerts than allowed, filtering by URL.
+
+        Limits are given per risk name (Informational, Low, Medium, High) or as ``total``, and are
+        checked against the ZAP alerts summary in a single call.
+
+        Arguments:
+
+        - ``url``: Url to be scanned, should be in ths format: http(s)://<address>
+        - ``limits``: maximum number of alerts, as risk=count pairs
+
+        *Example:*
+
+        | Zap Alerts Should Not Exceed | ${URL} | High=0 | Medium=5 |
+        | Zap Alerts Should Not Exceed | ${URL} | total=20 |         |
+        """
+        summary = self.get_zap_alert_summary(url, by_plugin=False)
+        exceeded = []
+        for name, limit in sorted(limits.items()):
+            if name.lower() == 'total':
+                found = summary['total']
+            else:
+                found = summary['risk'].get(RISK_LEVELS[_level_id(name, RISK_LEVELS)], 0)
+            if found > int(limit):
+                exceeded.append('{} alerts: {} > {}'.format(name, found, limit))
+        if exceeded:
+            raise AssertionError('ZAP alerts exceed the limits for {}: {}'.format(url, ', '.join(exceeded)))
+
+    def save_zap_alert_baseline(self, url, path):
+        """Saves the alerts raised by ZAP, filtering by URL, as a baseline for `Get Zap Alert Changes`.
+
+        Only a short hash of each alert plugin id, url, parameter and method is stored, together
+        with the alert name, risk, url, parameter and method to report resolved alerts.
+
+        Arguments:
+
+        - ``url``: Url to be scanned, should be in ths format: http(s)://<address>
+        - ``path``: file where the baseline is saved
+
+        Returns the number of alerts in the baseline.
+
+        *Example:*
+
+        | Save Zap Alert Baseline | ${URL} | ${ZAP_REPORT_PATH}${/}baseline.json |
+        """
+        baseline = {}
+        for batch in self.get_zap_alert_batches(url):
+            for alert in batch:
+                baseline[_alert_key(alert)] = _alert_entry(alert)
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(u'{}'.format(json.dumps(baseline, separators=(',', ':'))))
+        info('Saved baseline of {} alerts in {}'.format(len(baseline), path))
+        return len(baseline)
+
+    def get_zap_alert_changes(self, url, path):
+        """Returns the alerts raised by ZAP, filtering by URL, that changed since the given baseline.
+
+        Arguments:
+
+        - ``url``: Url to be scanned, should be in ths format: http(s)://<address>
+        - ``path``: baseline file saved with `Save Zap Alert Baseline`
+
+        Returns a dictionary with the ``new`` alerts, as returned by ZAP, and the ``resolved``
+        alerts, as dictionaries with keys ``pluginId``, ``name``, ``risk``, ``url``, ``param`` and ``method``.
+
+        *Example:*
+
+        | ${changes}= | Get Zap Alert Changes | ${URL} | ${ZAP_REPORT_PATH}${/}baseline.json |
+        | Should Be Empty | ${changes['new']} |
+        """
+        with io.open(path, encoding='utf-8') as f:
+            baseline = json.load(f)
+        current = set()
+        new = []
+        for batch in self.get_zap_alert_batches(url):
+            for alert in batch:
+                key = _alert_key(alert)
+                if key not in baseline and key not in current:
+                    new.append(alert)
+                current.add(key)
+        fields = ('pluginId', 'name', 'risk', 'url', 'param', 'method')
+        resolved = [dict(zip(fields, baseline[key])) for key in set(baseline) - current]
+        info('{} new and {} resolved alerts since baseline {}'.format(len(new), len(resolved), path))
+        return {'new': new, 'resolved': resolved}
+
+    def use_zap_daemon_pool(self, size, base_port=8090, host='localhost', path=None, allocation_dir=None,
+                            timeout='2 minutes'):
+        """Binds the library to one ZAP daemon of a pool, so parallel runs do not share ZAP sessions.
+
+        The pool has ``size`` daemons listening on consecutive ports from ``base_port``. Each process,
+        usually a pabot worker, claims a free daemon by creating a file in ``allocation_dir``,
+        starting from the one matching its pabot execution pool id. When ``path`` is given and the
+        claimed daemon is not running, it is started with `Start Headless Zap`.
+
+        The following keywords, including `Set Firefox Proxy` and `Set Chrome Proxy`, use the claimed
+        daemon. It is freed by `Release Zap Daemon`, claims of ended processes are taken over.
+
+        Arguments:
+
+        - ``size``: number of ZAP daemons in the pool
+        - ``base_port``: port of the first ZAP daemon
+        - ``host``: ZAP Local proxy address of all the daemons
+        - ``path``: OWASP ZAP path, to start the claimed daemon when it is not running
+        - ``allocation_dir``: directory shared by the processes to claim daemons, a temporary one by default
+        - ``timeout``: maximum time to wait for a started daemon to be ready
+
+        Returns the proxy URL of the claimed daemon.
+
+        *Example:*
+
+        | Suite Setup | Use Zap Daemon Pool | 4 | base_port=8090 | path=${ZAP_PATH} |
+        """
+        self.release_zap_daemon()
+        ports = [int(base_port) + index for index in range(int(size))]
+        directory = allocation_dir or os.path.join(tempfile.gettempdir(), 'zaplibrary-pool')
+        port, self._zap_claim = _claim_slot(directory, ports, _worker_index())
+        self._connect('http://{}:{}'.format(host, port))
+        info('Using ZAP daemon {}'.format(self._proxy))
+        if path is not None:
+            try:
+                self.zap.core.version
+            except requests.exceptions.RequestException:
+                self.start_headless_zap(path, port, host, timeout=timeout)
+        return self._proxy
+
+    def release_zap_daemon(self):
+        """Frees the ZAP daemon claimed by `Use Zap Daemon Pool`, the daemon keeps running.
+
+        *Example:*
+
+        | Suite Teardown | Release Zap Daemon |
+        """
+        claim, self._zap_claim = self._zap_claim, None
+        if claim is not None:
+            try:
+                os.remove(claim)
+            except OSError:
+                pass
+            info('Released ZAP daemon {}'.format(self._proxy))
+
+    def shutdown_zap(self, timeout='1 minute'):
         """Shutdown Zap application
+        When ZAP was started by `Start Headless Zap`, waits for its process to exit, killing it
+        after ``timeout``.
         Examples:
         | Shutdown Zap |
+        | Shutdown Zap | timeout=30s |
         """
         info("Shutting Down ZAP")
-        return self.zap.core.shutdown()
+        result = self.zap.core.shutdown()
+        process, self._zap_process = self._zap_process, None
+        if process is not None:
+            try:
+                _ScanWaiter(0.1, 1.0).wait('ZAP shutdown', process.poll, lambda code: code is not None,
+                                           timeout=timestr_to_secs(timeout))
+            except AssertionError:
+                warn('ZAP did not exit within {}, killing it'.format(timeout))
+                _kill_zap(process)
+        self._close_zap_log()
+        return result
+
+    def _close_zap_log(self):
+        if self._zap_log is not None:
+            self._zap_log.close()
+            self._zap_log = None
 
     def get_zap_sites(self):
         """Returns,in JSON format, a list of sites accessed by ZAP during the test.
@@ -192,36 +1435,165 @@ class zapLibrary(object):
         info('Generated html report')
         return self.zap.core.htmlreport()
 
-    @staticmethod
-    def start_headless_zap(path):
+    def save_zap_report(self, path, report_format='html', compress=False, chunk_size=65536):
+        """Saves the Report of the ZAP scan in a file, streaming it from ZAP in chunks.
+
+        The report is never held whole in memory nor returned to Robot Framework, so it does
+        not end up in the output.xml log. Prefer it to `Get Zap Html Report` for big scans.
+        It is written to a temporary file next to ``path``, renamed to ``path`` once complete, so
+        a failed download never leaves a truncated report.
+
+        Arguments:
+
+        - ``path``: file where the report is saved
+        - ``report_format``: one of html, xml, json or markdown
+        - ``compress``: gzip the report, also done when ``path`` ends with .gz
+        - ``chunk_size``: size in bytes of the chunks written to the file
+
+        Returns the size in bytes of the report, after any HTTP content decoding and before compression.
+
+        *Example:*
+
+        | Save Zap Report | ${ZAP_REPORT_PATH}${/}${TEST NAME}.html |                 |
+        | Save Zap Report | ${ZAP_REPORT_PATH}${/}report.json.gz    | report_format=json |
+        """
+        report = REPORT_FORMATS.get(report_format.lower())
+        if report is None:
+            raise ValueError('Unknown report format {}, expected one of {}'
+                             .format(report_format, ', '.join(sorted(REPORT_FORMATS))))
+        compress = str(compress).upper() not in ('FALSE', 'NO', 'OFF', '0', '') or path.endswith('.gz')
+        response = self._stream_other('core/other/{}/'.format(report))
+        try:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            counter = _CountingReader(response.raw)
+            fd, part = tempfile.mkstemp(suffix='.part', prefix=os.path.basename(path) + '.',
+                                        dir=os.path.dirname(os.path.abspath(path)))
+            try:
+                with io.open(fd, 'wb') as raw:
+                    with (gzip.GzipFile(os.path.basename(path), 'wb', fileobj=raw) if compress else raw) as f:
+                        shutil.copyfileobj(counter, f, int(chunk_size))
+                getattr(os, 'replace', os.rename)(part, path)
+            except Exception:
+                os.remove(part)
+                raise
+        finally:
+            response.close()
+        info('Saved {} report of {} bytes in {}'.format(report_format, counter.size, path))
+        return counter.size
+
+    def _stream_other(self, endpoint, params=None):
+        """Requests a ZAP API OTHER endpoint without reading its body."""
+        return self.zap._request_api(self.zap.base_other + endpoint, params, stream=True)
+
+    def start_headless_zap(self, path, port=None, host=None, memory=None, timeout='2 minutes', log_file=None,
+                           config=()):
         """Start OWASP Zap without gui. Run OWASP ZAP in a daemon mode which is then controlled via a REST Application programming interface.
 
+        ZAP is started on the host and port of the library ``proxy`` with its ``apikey``, without
+        checking for updates, and the keyword returns once the ZAP API answers. The startup time,
+        in seconds, is returned and kept in the ``zap_startup_time`` attribute.
+
+        The keyword fails when the port is already in use. When ZAP is not ready within ``timeout``,
+        its process is killed before failing.
+
         Arguments:
 
         - ``path``: OWASP ZAP path
+        - ``port``: ZAP Local proxy Port, defaults to the one of the library ``proxy``
+        - ``host``: ZAP Local proxy address, defaults to the one of the library ``proxy``
+        - ``memory``: JVM maximum heap, like 2g, ZAP default when not given
+        - ``timeout``: maximum time to wait for ZAP to be ready
+        - ``log_file``: file receiving the ZAP console output, discarded when not given
+        - ``config``: list of extra ZAP configurations, in key=value format, or a single one
 
         *Example:*
 
         | Start Headless Zap | C:\\OWASP\\ZedAttackProxy |
 
-        | Start Headless Zap | ${ZAP_PATH} |
+        | @{CONFIG}=         | Create List | ascan.threadPerHost=4 |                  |
+        | Start Headless Zap | ${ZAP_PATH} | memory=2g             | config=${CONFIG} |
         """
+        if self._zap_process is not None and self._zap_process.poll() is None:
+            raise RuntimeError('ZAP is already running with pid {}'.format(self._zap_process.pid))
+        self._zap_process = None
+        self._close_zap_log()
+        address = urlparse(self._proxy)
+        host = host or address.hostname
+        port = int(port or address.port or 8080)
+        if _listening(host, port):
+            raise RuntimeError('Port {} of {} is already in use, is another ZAP running?'.format(port, host))
+        if (host, port) != (address.hostname, address.port):
+            self._connect('http://{}:{}'.format(host, port))
+        command = [_zap_executable(path), '-daemon', '-silent', '-host', host, '-port', str(port)]
+        if memory:
+            command.insert(1, '-Xmx{}'.format(memory))
+        if self._apikey:
+            command += ['-config', 'api.key={}'.format(self._apikey)]
+        else:
+            command += ['-config', 'api.disablekey=true']
+        if not isinstance(config, (list, tuple)):
+            config = [config] if config else []
+        for option in ['start.checkForUpdates=false'] + list(config):
+            command += ['-config', option]
+        self._zap_log = io.open(log_file or os.devnull, 'ab')
+        start = time.time()
         try:
-            os.chdir(path)
-            os.popen('zap -daemon')
-            info('ZAP RUNNING')
-        except IOError as e:
-            warn("The OWASP ZAP path is not correctly configured!")
+            # own process group, so the JVM started by the ZAP script can be killed with it
+            if os.name == 'nt':
+                group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+            else:
+                group = {'preexec_fn': os.setsid}
+            self._zap_process = subprocess.Popen(command, cwd=path, stdout=self._zap_log, stderr=subprocess.STDOUT,
+                                                 **group)
+        except Exception:
+            self._close_zap_log()
+            raise
+        info('Starting ZAP, pid {}: {}'.format(self._zap_process.pid, ' '.join(command)))
+
+        def version():
+            if self._zap_process.poll() is not None:
+                raise RuntimeError('ZAP exited with code {} before being ready'.format(self._zap_process.returncode))
+            try:
+                return self.zap.core.version
+            except requests.exceptions.RequestException:
+                return None
 
-    @staticmethod
-    def set_firefox_proxy(host, port):
+        try:
+            zap_version = _ScanWaiter(0.1, 1.0).wait('ZAP startup', version, lambda value: value is not None,
+                                                     timeout=timestr_to_secs(timeout))
+        except Exception:
+            process, self._zap_process = self._zap_process, None
+            _kill_zap(process)
+            self._close_zap_log()
+            raise
+        self.zap_startup_time = round(time.time() - start, 3)
+        info('ZAP {} RUNNING, started in {} seconds'.format(zap_version, self.zap_startup_time))
+        return self.zap_startup_time
+
+    def _browser_proxy(self, host, port):
+        """Returns the host and port browsers should use, the claimed pool daemon wins over given ones."""
+        address = urlparse(self._proxy)
+        if self._zap_claim is not None:
+            if host is not None and (host, str(port)) != (address.hostname, str(address.port)):
+                warn('Using the claimed ZAP daemon {} instead of {}:{}'.format(self._proxy, host, port))
+            return address.hostname, address.port
+        if host is None:
+            host = address.hostname
+        if port is None:
+            port = address.port or 8080
+        return host, port
+
+    def set_firefox_proxy(self, host=None, port=None):
         """
         Configure a Firefox profile to be able to run a Firefox Browser instance that allows run redirect all Request and Reponses to ZAP application
 
         Arguments:
 
-        - ``host``: ZAP Local proxy address
-        - ``port``: ZAP Local proxy Port
+        - ``host``: ZAP Local proxy address, defaults to the one of the library ``proxy``
+        - ``port``: ZAP Local proxy Port, defaults to the one of the library ``proxy``
+
+        When a daemon was claimed by `Use Zap Daemon Pool`, its address is used.
 
         *Example:*
 
@@ -232,6 +1604,7 @@ class zapLibrary(object):
         | Go to             | ${url}            |                            |            |
 
         """
+        host, port = self._browser_proxy(host, port)
         profile = webdriver.FirefoxProfile()
         profile.set_preference('network.proxy.http', host)
         profile.set_preference('network.proxy.http_port', int(port))
@@ -241,15 +1614,16 @@ class zapLibrary(object):
         profile.update_preferences()
         return profile
 
-    @staticmethod
-    def set_chrome_proxy(host, port):
+    def set_chrome_proxy(self, host=None, port=None):
         """
         Configure a Chrome options to be able to run a Chrome Browser instance that allows run redirect all Request and Reponses to ZAP application
 
         Arguments:
 
-        - ``host``: ZAP Local proxy address
-        - ``port``: ZAP Local proxy Port
+        - ``host``: ZAP Local proxy address, defaults to the one of the library ``proxy``
+        - ``port``: ZAP Local proxy Port, defaults to the one of the library ``proxy``
+
+        When a daemon was claimed by `Use Zap Daemon Pool`, its address is used.
 
         *Example:*
 
@@ -260,7 +1634,8 @@ class zapLibrary(object):
         | Go To             | ${url}            |                           |               |
 
         """
-        PROXY = host + ":" + port
+        host, port = self._browser_proxy(host, port)
+        PROXY = '{}:{}'.format(host, port)
         chrome_options = webdriver.ChromeOptions()
         chrome_options.add_argument('--proxy-server=%s' % PROXY)
         return chrome_options